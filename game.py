@@ -1,17 +1,22 @@
 import os
 import tkinter as tk
-from tkinter import ttk, scrolledtext, font, messagebox
-from groq import Groq
-from dataclasses import dataclass
+from tkinter import ttk, scrolledtext, font
+from dataclasses import dataclass, field
 from typing import List, Dict
 import json
-from dotenv import load_dotenv
 import threading
-import copy
+import asyncio
+import time
 import re
+import hashlib
+import csv
+from collections import deque
+from game_prompts import SYSTEM_PROMPT, MAX_STEPS
 
-# Load environment variables from .env file
-load_dotenv()
+try:
+    import orjson  # Optional, faster JSON parsing/serialization
+except ImportError:
+    orjson = None
 
 # Custom styling constants
 BACKGROUND_COLOR = "#2C3E50"  # Dark blue-gray
@@ -22,59 +27,264 @@ HEALTH_COLOR = "#2ECC71"  # Green
 BUTTON_BG = "#34495E"  # Lighter blue-gray
 BUTTON_ACTIVE_BG = "#E74C3C"  # Red when active
 
+# LLM request settings
+REQUEST_TIMEOUT = 12.0  # Seconds; just above typical latency so stuck calls get retried
+REQUEST_ATTEMPTS = 3
+RETRY_BACKOFF = 1.0  # Seconds before the first retry after a rate limit or server error
+SCENE_MAX_TOKENS = 350  # Output cap per scene; generation time grows with output length
+MODEL = "llama-3.1-8b-instant"
+TEMPERATURE = 0.8
+TOP_P = 0.9  # Trims the unlikely tail that tends to derail the JSON format
+STORY_STOP = ["\n\n\n"]  # Ends streamed scenes that trail off into prose after the JSON
+SCENE_RETRY_BUDGET = 20.0  # Seconds process_scene may spend re-asking for unparseable scenes
+MAX_HISTORY_TOKENS = 2000  # Rough budget for the turns sent after the system prompt
+DEV_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".faq-cache")  # Used when FAQ_DEV_CACHE=1
+PERF_LOG_ENV = "FAQ_PERF_LOG"  # CSV path that per-turn timings are appended to on exit
+
+# Compiled once at import instead of on every LLM response
+_STORY_START_RE = re.compile(r'"story"\s*:\s*"')
+
 def extract_json(text: str) -> str:
     """
-    Extracts the first JSON object found in the text using a regex.
+    Extracts the first JSON object found in the text with a single pass that tracks
+    brace depth and skips over string literals, so braces inside strings and any
+    trailing text after the object are handled correctly.
+    """
+    start = text.find('{')
+    if start == -1:
+        return text  # Fallback in case no JSON object is found
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]  # Unbalanced (e.g. truncated); let the JSON parser report it
+
+class StoryStream:
+    """
+    Incrementally decodes the "story" string of a streamed JSON scene, so each chunk
+    costs time proportional to its own length instead of everything received so far.
     """
-    match = re.search(r'\{.*\}', text, re.DOTALL)
-    if match:
-        return match.group(0)
-    return text  # Fallback in case no JSON object is found
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
 
-@dataclass
+    def __init__(self):
+        self.prefix = ""  # Text received before the story value starts
+        self.in_story = False
+        self.done = False
+        self.escape = None  # Unfinished escape sequence, e.g. "\\u00"
+        self.high_surrogate = None
+
+    def feed(self, piece: str) -> str:
+        """
+        Returns the story text contained in this chunk, or "" if there is none.
+        """
+        if self.done:
+            return ""
+        if not self.in_story:
+            self.prefix += piece
+            match = _STORY_START_RE.search(self.prefix)
+            if not match:
+                return ""
+            self.in_story = True
+            piece = self.prefix[match.end():]
+            self.prefix = ""
+        out = []
+        for ch in piece:
+            if self.escape is not None:
+                self.escape += ch
+                if self.escape[1] == "u":
+                    if len(self.escape) < 6:
+                        continue
+                    self.decode_unicode_escape(self.escape[2:], out)
+                else:
+                    out.append(self.ESCAPES.get(ch, ch))
+                self.escape = None
+            elif ch == "\\":
+                self.escape = ch
+            elif ch == '"':
+                self.done = True
+                break
+            else:
+                out.append(ch)
+        return "".join(out)
+
+    def decode_unicode_escape(self, digits: str, out: List[str]):
+        try:
+            code = int(digits, 16)
+        except ValueError:
+            return
+        if 0xD800 <= code < 0xDC00:
+            # First half of a surrogate pair; wait for the second
+            self.high_surrogate = code
+        elif 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+            out.append(chr(0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)))
+            self.high_surrogate = None
+        else:
+            out.append(chr(code))
+
+def compact_json(obj) -> str:
+    """
+    Serializes obj without the spaces json.dumps puts after separators, which would cost prompt tokens.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+class Scene(dict):
+    """
+    A parsed scene that also remembers the exact JSON text the model sent, so history can
+    reuse it verbatim. The text is an attribute rather than a key, so it never shows up
+    when the scene is read or serialized.
+    """
+    __slots__ = ("raw",)
+
+def load_scene(text: str):
+    """
+    Parses a scene, keeping the model's JSON text on it so history can reuse it.
+    """
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either
+    scene = orjson.loads(text) if orjson is not None else json.loads(text)
+    if isinstance(scene, dict):
+        scene = Scene(scene)
+        scene.raw = text
+    return scene
+
+class PerfLog:
+    """
+    Per-turn latency and token counts, kept in memory and appended to a CSV file on exit.
+    A turn runs from the player's click until its scene is shown. prefill_latency_ms is
+    measured from sending the streamed request, first_token_ms from the click; tokens are
+    summed over every request that completes during the turn, retries included. Prefetch
+    requests finish while the player is still reading, so their tokens are collected
+    separately and reported on the turn they were speculating for.
+    """
+    FIELDS = (
+        "step", "source", "prefill_latency_ms", "first_token_ms", "total_ms",
+        "prompt_tokens", "completion_tokens", "prefetch_prompt_tokens", "prefetch_completion_tokens"
+    )
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.rows = []
+        self._row = None
+        self._start = 0
+        # Prefetch usage not yet reported, as [prompt_tokens, completion_tokens]
+        self._prefetch_usage = [0, 0]
+        self._prefetch_lock = threading.Lock()
+    
+    # begin/end run on the Tk thread, the rest on the loop thread, so those read
+    # _row once and work on that row even if end() clears the attribute meanwhile
+    
+    def begin(self, step: int):
+        self._start = time.perf_counter_ns()
+        # "local" unless a request path marks it live or prefetched
+        self._row = {"step": step, "source": "local"}
+    
+    def mark(self, **values):
+        row = self._row
+        if row is not None:
+            row.update(values)
+    
+    def request_sent(self):
+        row = self._row
+        if row is not None:
+            row["_request_start"] = time.perf_counter_ns()
+    
+    def first_token(self):
+        row = self._row
+        if row is not None and "first_token_ms" not in row:
+            now = time.perf_counter_ns()
+            row["first_token_ms"] = (now - self._start) / 1e6
+            if "_request_start" in row:
+                row["prefill_latency_ms"] = (now - row["_request_start"]) / 1e6
+    
+    def add_usage(self, usage, prefetch=False):
+        if usage is None:
+            return
+        if prefetch:
+            with self._prefetch_lock:
+                self._prefetch_usage[0] += usage.prompt_tokens
+                self._prefetch_usage[1] += usage.completion_tokens
+            return
+        row = self._row
+        if row is not None:
+            row["prompt_tokens"] = row.get("prompt_tokens", 0) + usage.prompt_tokens
+            row["completion_tokens"] = row.get("completion_tokens", 0) + usage.completion_tokens
+    
+    def end(self):
+        row = self._row
+        if row is not None:
+            row["total_ms"] = (time.perf_counter_ns() - self._start) / 1e6
+            with self._prefetch_lock:
+                row["prefetch_prompt_tokens"], row["prefetch_completion_tokens"] = self._prefetch_usage
+                self._prefetch_usage = [0, 0]
+            self.rows.append(row)
+            self._row = None
+    
+    def flush(self):
+        if not self.path or not self.rows:
+            return
+        write_header = not os.path.exists(self.path)
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            # extrasaction skips bookkeeping keys such as _request_start
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS, restval="", extrasaction="ignore")
+            if write_header:
+                writer.writeheader()
+            writer.writerows(self.rows)
+        self.rows.clear()
+
+@dataclass(slots=True)
 class PlayerState:
     health: int = 100
     gold: int = 0
     inventory: List[str] = None
     step: int = 0
+    # Last compact_state() result and the state it was built from
+    _cache_key: tuple = field(default=None, init=False, repr=False, compare=False)
+    _state: str = field(default=None, init=False, repr=False, compare=False)
+    # Last inventory_text() result and the inventory length it was built from
+    _inventory_len: int = field(default=-1, init=False, repr=False, compare=False)
+    _inventory_text: str = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if self.inventory is None:
             self.inventory = []
 
-    def to_dict(self) -> Dict:
-        return {
-            "health": self.health,
-            "gold": self.gold,
-            "inventory": self.inventory,
-            "step": self.step
-        }
-
-class CustomButton(tk.Button):
-    def __init__(self, master=None, **kwargs):
-        super().__init__(master, **kwargs)
-        self.config(
-            background="#2F3136",  # Discord-like dark gray
-            foreground="#FFFFFF",  # White text
-            activebackground="#7289DA",  # Discord-like blue when active
-            activeforeground="#FFFFFF",
-            relief=tk.FLAT,  # Flat modern look
-            borderwidth=0,
-            padx=20,
-            pady=12,
-            font=('Helvetica', 11),
-            cursor="hand2"  # Hand cursor on hover
-        )
-        self.bind('<Enter>', self.on_enter)
-        self.bind('<Leave>', self.on_leave)
-
-    def on_enter(self, e):
-        if self['state'] != 'disabled':
-            self['background'] = "#7289DA"  # Discord-like blue
+    def inventory_text(self) -> str:
+        # Items are only ever added, so the length tells whether the join is stale
+        if self._inventory_len != len(self.inventory):
+            self._inventory_len = len(self.inventory)
+            self._inventory_text = ", ".join(self.inventory) if self.inventory else "None"
+        return self._inventory_text
 
-    def on_leave(self, e):
-        if self['state'] != 'disabled':
-            self['background'] = "#2F3136"  # Back to dark gray
+    def compact_state(self) -> str:
+        """
+        Fixed-format one-line summary used in prompts; the stable layout tokenizes the same way every turn.
+        """
+        # Only rebuilt when the state changed since the last call
+        key = (self.health, self.gold, self.step, len(self.inventory))
+        if key != self._cache_key:
+            self._cache_key = key
+            self._state = (
+                f"health={self.health} gold={self.gold} step={self.step} "
+                f"inventory={'|'.join(self.inventory)}"
+            )
+        return self._state
 
 class AdventureGameGUI:
     def __init__(self, root):
@@ -88,10 +298,29 @@ class AdventureGameGUI:
         self.text_font = font.Font(family='Helvetica', size=12)
         self.stats_font = font.Font(family='Helvetica', size=10, weight='bold')
         
+        # All LLM I/O runs as coroutines on one asyncio loop in a sidecar thread,
+        # so Tk stays on the main thread and no thread is spawned per request
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._closing = False
+        self.root.protocol("WM_DELETE_WINDOW", self.shutdown)
+        
         # Initialize game logic
         self.game = AdventureGame(self)
         self.current_scene = None
-        self.loading = False
+        # Set while a scene request is pending
+        self._loading = threading.Event()
+        self._loading_after = None
+        # Values last written to the inventory and progress widgets
+        self._shown_inventory = None
+        self._shown_step = None
+        # Text currently in story_text, so updates don't have to read it back from Tk
+        self._displayed_story = ""
+        
+        # Futures for the speculatively generated next scenes, keyed by choice number,
+        # and for the batched request that feeds them
+        self._prefetch = {}
+        self._prefetch_batch = None
         
         # Add loading messages
         self.loading_messages = [
@@ -107,6 +336,8 @@ class AdventureGameGUI:
             "🎭 Writing the next chapter..."
         ]
         self.loading_frames = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
+        # Every frame/message combination, built once instead of formatted on each tick
+        self._loading_cache = [[f"{frame} {message}" for frame in self.loading_frames] for message in self.loading_messages]
         self.loading_frame_idx = 0
         self.loading_label = None
         
@@ -126,6 +357,26 @@ class AdventureGameGUI:
         BUTTON_BG = "#2F3136"  # Discord-like dark gray
         BUTTON_ACTIVE_BG = "#7289DA"  # Discord-like blue when active
         
+        # One named button style, configured once; hover and disabled looks are
+        # handled by Tk's state maps instead of Python <Enter>/<Leave> bindings.
+        # clam is used because native themes ignore custom button colors.
+        style = ttk.Style(self.root)
+        style.theme_use("clam")
+        style.configure(
+            "Fantasy.TButton",
+            background=BUTTON_BG,
+            foreground="#FFFFFF",
+            borderwidth=0,
+            relief=tk.FLAT,
+            padding=(20, 12),
+            font=('Helvetica', 11)
+        )
+        style.map(
+            "Fantasy.TButton",
+            background=[("disabled", BUTTON_BG), ("active", BUTTON_ACTIVE_BG)],
+            foreground=[("disabled", "#72767D")]
+        )
+        
         # Create main frame with padding
         main_frame = tk.Frame(self.root, bg=BACKGROUND_COLOR, padx=20, pady=20)
         main_frame.pack(expand=True, fill='both')
@@ -170,9 +421,14 @@ class AdventureGameGUI:
         stats_row = tk.Frame(left_stats, bg=BACKGROUND_COLOR)
         stats_row.pack(fill='x')
         
+        # Stat labels are bound to StringVars so refreshes skip the config protocol
+        self.health_var = tk.StringVar(value="❤️ Health: 100")
+        self.gold_var = tk.StringVar(value="💰 Gold: 0")
+        self.progress_var = tk.StringVar(value=f"Step: 0/{MAX_STEPS}")
+        
         self.health_label = tk.Label(
             stats_row,
-            text="❤️ Health: 100",
+            textvariable=self.health_var,
             font=self.stats_font,
             bg=BACKGROUND_COLOR,
             fg=HEALTH_COLOR,
@@ -182,7 +438,7 @@ class AdventureGameGUI:
         
         self.gold_label = tk.Label(
             stats_row,
-            text="💰 Gold: 0",
+            textvariable=self.gold_var,
             font=self.stats_font,
             bg=BACKGROUND_COLOR,
             fg=GOLD_COLOR,
@@ -197,7 +453,7 @@ class AdventureGameGUI:
         # Progress label
         self.progress_label = tk.Label(
             right_stats,
-            text="Step: 0/5",
+            textvariable=self.progress_var,
             font=self.stats_font,
             bg=BACKGROUND_COLOR,
             fg=TEXT_COLOR,
@@ -243,11 +499,13 @@ class AdventureGameGUI:
         self.loading_label.pack(pady=(0, 15))
         
         # Add restart button (initially hidden)
-        self.restart_button = CustomButton(
+        self.restart_button = ttk.Button(
             main_frame,
             text="Play Again",
             command=self.restart_game,
-            state="disabled"
+            state="disabled",
+            style="Fantasy.TButton",
+            cursor="hand2"
         )
         self.restart_button.pack(fill='x', pady=3)
         self.restart_button.pack_forget()  # Hide initially
@@ -258,68 +516,170 @@ class AdventureGameGUI:
         
         self.choice_buttons = []
         for i in range(3):
-            btn = CustomButton(
+            btn = ttk.Button(
                 choices_frame,
                 text="",
                 state="disabled",
-                command=lambda x=i+1: self.on_choice_clicked(x)
+                command=lambda x=i+1: self.on_choice_clicked(x),
+                style="Fantasy.TButton",
+                cursor="hand2"
             )
             btn.pack(fill='x', pady=3)
             self.choice_buttons.append(btn)
     
+    def submit(self, coro, on_done=None):
+        # Every background job runs on the one shared loop; its result is handed to
+        # on_done on the Tk thread, so coroutines never touch GUI state themselves
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda f: self._on_task_done(f, on_done))
+        return future
+    
+    def _on_task_done(self, future, on_done):
+        # Runs on the loop thread; marshal to Tk
+        if not self._closing and not future.cancelled():
+            self.root.after(0, self._finish_task, future, on_done)
+    
+    def _finish_task(self, future, on_done):
+        error = future.exception()
+        if error is not None:
+            print(f"Background task failed: {error!r}")
+            if on_done is not None:
+                on_done(self.game.end_game(game_over_message="An unexpected error occurred. The adventure ends here."))
+        elif on_done is not None:
+            on_done(future.result())
+    
+    def shutdown(self):
+        # Drop pending work, close pooled connections, then stop the loop and the window
+        self._closing = True
+        self.cancel_prefetch()
+        try:
+            asyncio.run_coroutine_threadsafe(self.game.close(), self.loop).result(timeout=1)
+        except Exception as e:
+            print(f"Error closing the LLM client: {e}")
+        try:
+            self.game.perf.flush()
+        except OSError as e:
+            print(f"Error writing the performance log: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.root.destroy()
+    
     def update_stats(self):
-        self.health_label.config(text=f"❤️ Health: {self.game.player.health}")
-        self.gold_label.config(text=f"💰 Gold: {self.game.player.gold}")
+        self.health_var.set(f"❤️ Health: {self.game.player.health}")
+        self.gold_var.set(f"💰 Gold: {self.game.player.gold}")
         
-        # Update inventory with scrollable text
-        self.inventory_text.config(state='normal')
-        self.inventory_text.delete(1.0, tk.END)
-        inventory_text = ", ".join(self.game.player.inventory) if self.game.player.inventory else "None"
-        self.inventory_text.insert(tk.END, inventory_text)
-        self.inventory_text.config(state='disabled')
+        # Update inventory with scrollable text, only when it changed
+        inventory_text = self.game.player.inventory_text()
+        if inventory_text != self._shown_inventory:
+            self._shown_inventory = inventory_text
+            self.inventory_text.config(state='normal')
+            self.inventory_text.delete(1.0, tk.END)
+            self.inventory_text.insert(tk.END, inventory_text)
+            self.inventory_text.config(state='disabled')
         
-        self.progress_label.config(text=f"Step: {self.game.player.step}/{self.game.MAX_STEPS}")
+        if self.game.player.step != self._shown_step:
+            self._shown_step = self.game.player.step
+            self.progress_var.set(f"Step: {self.game.player.step}/{self.game.MAX_STEPS}")
     
     def update_loading_animation(self):
-        if self.loading:
-            message = self.loading_messages[self.game.player.step % len(self.loading_messages)]
-            frame = self.loading_frames[self.loading_frame_idx]
-            self.loading_frame_idx = (self.loading_frame_idx + 1) % len(self.loading_frames)
-            self.loading_label.config(text=f"{frame} {message}")
-            self.root.after(100, self.update_loading_animation)
+        if self._loading.is_set():
+            frames = self._loading_cache[self.game.player.step % len(self._loading_cache)]
+            self.loading_label.config(text=frames[self.loading_frame_idx])
+            self.loading_frame_idx = (self.loading_frame_idx + 1) % len(frames)
+            # 150ms is still smooth to the eye and wakes Tk a third less often than 100ms
+            self._loading_after = self.root.after(150, self.update_loading_animation)
         else:
-            self.loading_label.config(text="")
+            self.stop_loading_animation()
+    
+    def stop_loading_animation(self):
+        # Cancel the pending tick so nothing is scheduled while no request is in flight
+        if self._loading_after is not None:
+            self.root.after_cancel(self._loading_after)
+            self._loading_after = None
+        self.loading_label.config(text="")
 
     def on_choice_clicked(self, choice_num):
-        if self.loading:
+        if self._loading.is_set():
             return
-        self.loading = True
+        self._loading.set()
         self.set_choice_buttons_state("disabled")
+        self.game.perf.begin(self.game.player.step + 1)
+        # Keep the speculative scene for this choice if it's ready and cancel the rest
+        prefetched = self.cancel_prefetch(keep=choice_num)
+        # Clear the story so the next scene can stream in
+        self.clear_story()
         self.update_loading_animation()  # Start loading animation
-        threading.Thread(target=self.process_choice, args=(choice_num,), daemon=True).start()
-    
-    def process_choice(self, choice_num):
-        # Make a deep copy of the current scene to avoid threading issues
-        scene_copy = copy.deepcopy(self.current_scene)
-        self.current_scene = self.game.make_choice(choice_num, scene_copy)
-        # Check for game over conditions (health or step count)
-        if self.game.player.health <= 0:
-            self.current_scene = self.game.end_game(game_over_message="You have perished in your quest!")
-        # Update the display on the main thread
-        self.root.after(0, self.update_game_display)
-        self.loading = False
+        # make_choice only reads the scene, so it can be passed without copying
+        self.submit(self.game.make_choice(choice_num, self.current_scene, prefetched), on_done=self.show_scene)
+    
+    def show_scene(self, scene):
+        self.current_scene = scene
+        self._loading.clear()
+        self.update_game_display()
+        self.game.perf.end()
+
+    def clear_story(self):
+        # Called once per scene, before its text starts streaming in
+        self.story_text.config(state='normal')
+        self.story_text.delete(1.0, tk.END)
+        self.story_text.config(state='disabled')
+        self._displayed_story = ""
+
+    def append_story(self, piece):
+        # Append streamed story text without redrawing the whole widget
+        self.story_text.config(state='normal')
+        self.story_text.insert(tk.END, piece)
+        self.story_text.see(tk.END)
+        self.story_text.config(state='disabled')
+        self._displayed_story += piece
+
+    def start_prefetch(self):
+        # Generate the scenes behind all choices while the player is still reading: one batched
+        # request for every branch, plus a task per choice that falls back to its own request
+        self.cancel_prefetch()
+        histories = self.game.branch_histories(self.current_scene)
+        if not histories:
+            return
+        self._prefetch_batch = self.submit(self.game.fetch_branches(self.game.batch_history(histories)))
+        self._prefetch = {
+            choice_num: self.submit(self.game.fetch_branch(choice_num, self._prefetch_batch, messages))
+            for choice_num, messages in histories.items()
+        }
+    
+    def cancel_prefetch(self, keep=None):
+        # Cancelling a future cancels its task, closing any in-flight request. Returns the
+        # future for choice `keep` only if its scene is already there; an unfinished one
+        # would make the player wait on the whole non-streamed batch, which is slower than
+        # streaming the scene live, so it is cancelled with the rest.
+        kept = self._prefetch.pop(keep, None)
+        if kept is not None and not kept.done():
+            kept.cancel()
+            kept = None
+        for future in self._prefetch.values():
+            future.cancel()
+        if kept is None and self._prefetch_batch is not None:
+            self._prefetch_batch.cancel()
+        self._prefetch = {}
+        self._prefetch_batch = None
+        return kept
 
     def set_choice_buttons_state(self, state):
         for btn in self.choice_buttons:
             btn.config(state=state)
     
     def update_game_display(self):
-        # Update story text with formatting
-        self.story_text.config(state='normal')
-        self.story_text.delete(1.0, tk.END)
+        self.stop_loading_animation()
+        # Streamed scenes are already on screen; if the stream stopped short only the
+        # missing tail is inserted, and only a different story (prefetched scenes,
+        # endings written locally) is rewritten in full
         story_text = self.current_scene.get("story", "").strip()
-        self.story_text.insert(tk.END, story_text)
-        self.story_text.config(state='disabled')
+        displayed = self._displayed_story
+        if story_text != displayed.strip():
+            if displayed and story_text.startswith(displayed):
+                self.append_story(story_text[len(displayed):])
+            else:
+                self.clear_story()
+                self.append_story(story_text)
+                self.story_text.see(1.0)
         
         # Update stats
         self.update_stats()
@@ -341,93 +701,308 @@ class AdventureGameGUI:
                 btn.pack_forget()
             self.restart_button.pack(fill='x', pady=3)
             self.restart_button.config(state="normal")
+        else:
+            self.start_prefetch()
 
     def start_game(self):
-        self.loading = True
-        threading.Thread(target=self.initialize_game, daemon=True).start()
-    
-    def initialize_game(self):
-        self.current_scene = self.game.initialize_story()
-        self.root.after(0, self.update_game_display)
-        self.loading = False
+        self._loading.set()
+        self.game.perf.begin(0)
+        self.update_loading_animation()
+        self.submit(self.game.initialize_story(), on_done=self.show_scene)
 
     def restart_game(self):
-        # Reset player state
-        self.game.player = PlayerState()
-        self.game.conversation_history = []
+        self.cancel_prefetch()
+        # Reset player state and conversation history
+        self.game.reset()
         # Hide restart button and show choice buttons
         self.restart_button.pack_forget()
         for btn in self.choice_buttons:
             btn.pack(fill='x', pady=3)
+        self.clear_story()
         # Start new game
         self.start_game()
 
 class AdventureGame:
     def __init__(self, gui):
+        # Imported here rather than at module level so the window can paint before
+        # groq (and the httpx/pydantic stack behind it) finishes loading
+        from dotenv import load_dotenv
+        from groq import AsyncGroq
+        import httpx
+        
+        # Load environment variables from .env file
+        load_dotenv()
+        
         # Get API key from environment variable
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise ValueError("GROQ_API_KEY environment variable not set")
         
-        self.client = Groq(api_key=api_key)
-        self.player = PlayerState()
-        self.conversation_history = []
-        self.MAX_STEPS = 5
-        self.gui = gui
-        # Predefine a system prompt (will be reused) and limit conversation history length.
-        self.system_prompt = (
-            "You are a dungeon master for a text-based adventure game. "
-            "Generate an engaging fantasy story with choices that affect the player's stats (health, gold) and inventory. "
-            "The game lasts exactly 5 steps. Each choice should be meaningful and interesting. "
-            "Return your response strictly in JSON format with the following structure:\n"
-            '{\n'
-            '    "story": "current situation description",\n'
-            '    "choices": ["choice 1", "choice 2", "choice 3"],\n'
-            '    "effects": {\n'
-            '        "1": {"health": modifier, "gold": modifier, "items": ["item1"]},\n'
-            '        "2": {"health": modifier, "gold": modifier, "items": ["item2"]},\n'
-            '        "3": {"health": modifier, "gold": modifier, "items": ["item3"]}\n'
-            "    }\n"
-            "}"
+        # One pooled HTTP/2 client so prefetches multiplex over a kept-alive connection
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=300),
+            timeout=30.0
         )
+        # Retries (timeouts, connection errors, 429s and 5xx) are handled by _complete,
+        # so the SDK's own retry loop is disabled
+        self.client = AsyncGroq(api_key=api_key, http_client=self.http_client, max_retries=0)
+        # Development only: replay earlier responses for identical requests
+        self.cache_dir = DEV_CACHE_DIR if os.getenv("FAQ_DEV_CACHE") == "1" else None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.perf = PerfLog(os.getenv(PERF_LOG_ENV))
+        self.MAX_STEPS = MAX_STEPS
+        self.gui = gui
+        # One system message object shared by every request of the session
+        self.system_message = {"role": "system", "content": SYSTEM_PROMPT}
+        self.reset()
+    
+    def reset(self):
+        self.player = PlayerState()
+        self._turns = deque()
+        self._turn_tokens = deque()  # Estimated tokens of each entry in _turns
+        self._history_tokens = 0
+    
+    @property
+    def conversation_history(self) -> List[Dict]:
+        # The system prompt is sent once, as the first message, and never trimmed or changed;
+        # per-turn state only goes into the trailing user messages
+        return [self.system_message, *self._turns]
+    
+    async def close(self):
+        await self.client.close()
+    
+    def _cache_path(self, messages, kwargs) -> str:
+        # The system prompt is the first message, so editing it changes every key
+        payload = json.dumps([messages, kwargs], sort_keys=True).encode()
+        return os.path.join(self.cache_dir, hashlib.blake2b(payload, digest_size=16).hexdigest() + ".txt")
+    
+    async def _cached_content(self, messages, prefetch=False, **kwargs) -> str:
+        """
+        Returns the response text for the messages, served from the dev cache when enabled.
+        Streamed requests still echo their story to the GUI on a miss. prefetch marks
+        speculative requests so the perf log counts their tokens separately.
+        """
+        # Defaults are filled in before hashing so changing them invalidates old entries
+        kwargs = self._request_args(kwargs)
+        path = self._cache_path(messages, kwargs) if self.cache_dir else None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        if kwargs.get("stream"):
+            self.perf.request_sent()
+        response = await self._complete(messages, **kwargs)
+        if kwargs.get("stream"):
+            content = await self.stream_content(response)
+        else:
+            self.perf.add_usage(getattr(response, "usage", None), prefetch=prefetch)
+            content = response.choices[0].message.content
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        return content
     
     def add_to_history(self, role: str, content: str):
-        self.conversation_history.append({"role": role, "content": content})
-        # Keep only the last few messages (plus the system prompt) to reduce token usage.
-        if len(self.conversation_history) > 10:
-            # Assuming the system prompt is always at index 0.
-            self.conversation_history = [self.conversation_history[0]] + self.conversation_history[-9:]
-    
-    def initialize_story(self):
-        prompt = (
-            f"{self.system_prompt}\n\n"
-            f"Current player state: {self.player.to_dict()}"
-        )
-        self.add_to_history("system", prompt)
-        self.add_to_history("user", "Start the adventure!")
-        return self.get_next_scene()
+        # Estimate ~4 characters per token and drop the oldest turns once over budget,
+        # always keeping the newest one. Each turn's estimate is stored alongside it so
+        # trimming is an O(1) popleft per turn.
+        tokens = len(content) // 4
+        self._turns.append({"role": role, "content": content})
+        self._turn_tokens.append(tokens)
+        self._history_tokens += tokens
+        while self._history_tokens > MAX_HISTORY_TOKENS and len(self._turns) > 1:
+            self._turns.popleft()
+            self._history_tokens -= self._turn_tokens.popleft()
     
-    def get_next_scene(self) -> dict:
-        # End the game if maximum steps have been reached
-        if self.player.step >= self.MAX_STEPS:
-            return self.end_game()
-        
+    async def initialize_story(self):
+        self.add_to_history("user", f"Start the adventure!\nPlayer state: {self.player.compact_state()}")
+        return await self.get_next_scene()
+    
+    async def get_next_scene(self) -> dict:
+        # After the final choice this returns the LLM-written ending (see choice_turns)
         try:
-            response = self.client.chat.completions.create(
-                messages=self.conversation_history,
-                model="llama-3.1-8b-instant"
-            )
-            content = response.choices[0].message.content
-            # Clean up any markdown formatting that might wrap the JSON
-            content = content.replace('```json', '').replace('```', '').strip()
-            # Extract only the JSON portion from the content
+            self.perf.mark(source="live")
+            content = await self._cached_content(self.conversation_history, stream=True, stop=STORY_STOP)
+            # Extract only the JSON portion; the scan starts at the first brace, so any
+            # markdown fences around it are skipped without a separate cleanup pass
             content = extract_json(content)
-            return self.process_scene(content)
+            return await self.process_scene(content)
         except Exception as e:
             print(f"Unexpected error: {e}")
             return self.end_game(game_over_message="An unexpected error occurred. The adventure ends here.")
     
-    def make_choice(self, choice_num: int, scene: dict):
+    @staticmethod
+    def _request_args(kwargs: dict) -> dict:
+        # The model and sampling settings every request uses unless the caller overrides them
+        return {
+            "model": MODEL,
+            "max_tokens": SCENE_MAX_TOKENS,
+            "temperature": TEMPERATURE,
+            "top_p": TOP_P,
+            **kwargs
+        }
+    
+    async def _complete(self, messages, **kwargs):
+        """
+        Requests a chat completion with a short timeout, retrying timeouts, connection errors,
+        rate limits and server errors with backoff.
+        """
+        from groq import APIConnectionError, RateLimitError, InternalServerError
+        import httpx
+        kwargs = self._request_args(kwargs)
+        for attempt in range(REQUEST_ATTEMPTS):
+            try:
+                return await self.client.chat.completions.create(
+                    messages=messages,
+                    timeout=REQUEST_TIMEOUT,
+                    **kwargs
+                )
+            except (httpx.TimeoutException, APIConnectionError) as e:
+                # APIConnectionError also covers APITimeoutError
+                if attempt == REQUEST_ATTEMPTS - 1:
+                    raise
+                print(f"Request failed ({e}), retrying...")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+            except (RateLimitError, InternalServerError) as e:
+                # Give the service longer to recover than a dropped connection needs
+                if attempt == REQUEST_ATTEMPTS - 1:
+                    raise
+                print(f"Request rejected ({e}), retrying...")
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    
+    async def stream_content(self, response) -> str:
+        """
+        Collects a streamed completion, echoing the story text to the GUI as it arrives.
+        """
+        buf = []
+        story = StoryStream()
+        async for chunk in response:
+            # Groq reports token usage on the last chunk
+            self.perf.add_usage(getattr(getattr(chunk, "x_groq", None), "usage", None))
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+            if not piece:
+                continue
+            if not buf:
+                self.perf.first_token()
+            buf.append(piece)
+            text = story.feed(piece)
+            if text:
+                self.gui.root.after(0, self.gui.append_story, text)
+        return "".join(buf)
+    
+    async def fetch_scene(self, messages) -> dict:
+        """
+        Generates a single scene without streaming it or touching game state.
+        Raises on API or JSON errors so speculative callers can fall back to a live request.
+        """
+        # Not streamed, so the server can be held to valid JSON
+        return load_scene(await self._cached_content(
+            messages,
+            prefetch=True,
+            response_format={"type": "json_object"}
+        ))
+    
+    async def fetch_branch(self, choice_num: int, batch, messages) -> dict:
+        """
+        Returns the scene for one choice: taken from the batched request if it produced it,
+        otherwise requested on its own with that branch's history.
+        """
+        try:
+            # Shielded so cancelling this branch doesn't cancel the batch other branches share
+            branches = await asyncio.shield(asyncio.wrap_future(batch))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Batched prefetch failed: {e}")
+            branches = {}
+        scene = branches.get(choice_num)
+        if scene is None:
+            scene = await self.fetch_scene(messages)
+        return scene
+    
+    async def fetch_branches(self, messages) -> Dict[int, dict]:
+        """
+        Generates the scenes asked for by batch_history in a single request, without
+        streaming them or touching game state. Branches that are missing or malformed are
+        left out; fetch_branch requests those separately.
+        """
+        batch = load_scene(await self._cached_content(
+            messages,
+            prefetch=True,
+            max_tokens=3 * SCENE_MAX_TOKENS,
+            response_format={"type": "json_object"}
+        ))
+        branches = {}
+        for choice_num in range(1, 4):
+            scene = batch.get(str(choice_num)) if isinstance(batch, dict) else None
+            if isinstance(scene, dict) and "choices" in scene:
+                branches[choice_num] = Scene(scene)
+        return branches
+    
+    def branch_histories(self, scene: dict) -> Dict[int, List[Dict]]:
+        """
+        Returns, for each choice that leads to a new scene, the conversation history as it
+        would be after picking it. Choices that end the game (death, final step) are left out.
+        """
+        histories = {}
+        for choice_num in range(1, len(scene.get("choices", [])) + 1):
+            try:
+                effects = scene["effects"][str(choice_num)]
+                player = PlayerState(
+                    health=self.player.health,
+                    gold=self.player.gold,
+                    inventory=list(self.player.inventory),
+                    step=self.player.step
+                )
+                self.apply_effects(player, effects)
+                turns = self.choice_turns(choice_num, scene, player)
+            except (KeyError, IndexError, TypeError, AttributeError):
+                continue
+            if player.health > 0 and player.step < self.MAX_STEPS:
+                histories[choice_num] = self.conversation_history + turns
+        return histories
+    
+    @staticmethod
+    def batch_history(histories: Dict[int, List[Dict]]) -> List[Dict]:
+        """
+        Merges the branch histories into one that asks for every branch in a single request,
+        answered as one JSON object keyed by choice number.
+        """
+        # All branches share everything but their final user turn
+        shared = next(iter(histories.values()))[:-1]
+        branches = [f'"{choice_num}": {messages[-1]["content"]}' for choice_num, messages in histories.items()]
+        return shared + [
+            {"role": "user", "content": (
+                "Before the player decides, write the next scene for each of these possible choices "
+                "independently. Reply with one JSON object whose keys are the choice numbers below "
+                "and whose values are the scene JSON objects.\n"
+                + "\n".join(branches)
+            )}
+        ]
+    
+    @staticmethod
+    def apply_effects(player: PlayerState, effects: dict):
+        player.health += effects.get("health", 0)
+        player.gold += effects.get("gold", 0)
+        items = effects.get("items")
+        if items:
+            player.inventory.extend(items)
+        player.step += 1
+    
+    def choice_turns(self, choice_num: int, scene: dict, player: PlayerState) -> List[Dict]:
+        # The assistant's scene followed by the player's choice, as history messages
+        choice_text = scene["choices"][choice_num - 1]
+        user_content = f"Choice made: {choice_text}\nNew player state: {player.compact_state()}"
+        if player.step >= self.MAX_STEPS:
+            # Have this response be the ending instead of asking for it in a separate call
+            user_content += "\nThat was the final choice. Write the ending now."
+        return [
+            {"role": "assistant", "content": getattr(scene, "raw", None) or compact_json(scene)},
+            {"role": "user", "content": user_content}
+        ]
+    
+    async def make_choice(self, choice_num: int, scene: dict, prefetched=None):
         # First check if we're already at max steps
         if self.player.step >= self.MAX_STEPS:
             return self.end_game(game_over_message=(
@@ -435,101 +1010,72 @@ class AdventureGame:
                 "As you reflect on your adventures, you realize how far you've come."
             ))
         
-        try:
-            # Add validation for required scene structure
-            if not isinstance(scene, dict):
-                print(f"Invalid scene format - expected dict, got: {type(scene)}")
-                raise KeyError("Invalid scene format")
-            
-            if "effects" not in scene:
-                print(f"Missing 'effects' in scene: {scene}")
-                raise KeyError("Missing effects")
-            
-            if str(choice_num) not in scene["effects"]:
-                print(f"Missing choice {choice_num} in effects: {scene['effects']}")
-                raise KeyError(f"Missing choice {choice_num}")
-            
-            effects = scene["effects"][str(choice_num)]
-            
-        except KeyError as e:
+        # Validate the scene structure with plain lookups rather than raising
+        # ("effects": [] or null is common for "no effects", so check types at both levels)
+        effects = scene.get("effects") if isinstance(scene, dict) else None
+        effects = effects.get(str(choice_num)) if isinstance(effects, dict) else None
+        if not isinstance(effects, dict):
+            print(f"Missing choice {choice_num} in scene effects: {scene}")
             # Give more context in the error message
             return self.end_game(game_over_message=(
                 "A mysterious force disrupts your adventure...\n\n"
                 "The ancient scrolls seem to have become illegible, "
                 "but your journey was still a memorable one!\n\n"
-                f"Technical note: {str(e)}"
+                f"Technical note: Missing choice {choice_num}"
             ))
         
         # Update player state
-        self.player.health += effects.get("health", 0)
-        self.player.gold += effects.get("gold", 0)
-        self.player.inventory.extend(effects.get("items", []))
-        self.player.step += 1
+        self.apply_effects(self.player, effects)
+        if self.player.health <= 0:
+            return self.end_game(game_over_message="You have perished in your quest!")
         
         # Add the current scene and player's choice to the conversation history.
-        self.add_to_history("assistant", json.dumps(scene))
-        choice_text = scene["choices"][choice_num - 1]
-        self.add_to_history("user", f"Choice made: {choice_text}\nNew player state: {self.player.to_dict()}")
-        
-        return self.get_next_scene()
-    
-    def end_game(self, game_over_message=None) -> dict:
-        if game_over_message:  # For premature endings (death, errors)
-            final_inventory = ', '.join(self.player.inventory) if self.player.inventory else "None"
-            return {
-                "story": (
-                    f"{game_over_message}\n\n"
-                    f"Final Stats:\n"
-                    f"Health: {self.player.health}\n"
-                    f"Gold: {self.player.gold}\n"
-                    f"Inventory: {final_inventory}"
-                ),
-                "choices": [],
-                "effects": {}
-            }
-        
-        # For normal game completion, get ending from LLM
-        try:
-            response = self.client.chat.completions.create(
-                messages=self.conversation_history,
-                model="llama-3.1-8b-instant"
-            )
-            content = response.choices[0].message.content
-            content = extract_json(content)
-            return self.process_scene(content)  # Use the same retry logic for endings
-        except Exception as e:
-            print(f"Error generating ending: {e}")
-            return {
-                "story": (
-                    "Your adventure comes to an end...\n\n"
-                    f"Final Stats:\n"
-                    f"Health: {self.player.health}\n"
-                    f"Gold: {self.player.gold}\n"
-                    f"Inventory: {', '.join(self.player.inventory) if self.player.inventory else 'None'}"
-                ),
-                "choices": [],
-                "effects": {}
-            }
-
-    def process_scene(self, scene_text, retries=0):
+        for turn in self.choice_turns(choice_num, scene, self.player):
+            self.add_to_history(turn["role"], turn["content"])
+        
+        # Use the speculatively generated scene for this choice if it made it through
+        if prefetched is not None and not prefetched.cancelled():
+            try:
+                scene = await asyncio.wrap_future(prefetched)
+                self.perf.mark(source="prefetched")
+                return scene
+            except Exception as e:
+                print(f"Prefetched scene unusable, generating it again: {e}")
+        return await self.get_next_scene()
+    
+    def end_game(self, game_over_message="Your adventure comes to an end...") -> dict:
+        # Premature endings (death, errors); normal endings are written by the LLM in get_next_scene
+        final_inventory = self.player.inventory_text()
+        return {
+            "story": (
+                f"{game_over_message}\n\n"
+                f"Final Stats:\n"
+                f"Health: {self.player.health}\n"
+                f"Gold: {self.player.gold}\n"
+                f"Inventory: {final_inventory}"
+            ),
+            "choices": [],
+            "effects": {}
+        }
+
+    async def process_scene(self, scene_text):
         MAX_RETRIES = 3
-        try:
-            scene_data = json.loads(scene_text)
-            return scene_data
-        except json.JSONDecodeError:
-            if retries < MAX_RETRIES:
-                print("*The ancient scroll seems blurry, trying to decipher it again...*")
-                # Retry the LLM call
-                response = self.client.chat.completions.create(
-                    messages=self.conversation_history,
-                    model="llama-3.1-8b-instant"
-                )
-                new_content = response.choices[0].message.content.strip()
-                new_content = extract_json(new_content)
-                return self.process_scene(new_content, retries + 1)
-            else:
-                return {
-                    "story": """
+        deadline = time.monotonic() + SCENE_RETRY_BUDGET
+        # Retries get a JSON-only reminder that is not kept in the conversation history
+        retry_messages = self.conversation_history + [
+            {"role": "user", "content": "Your last response was not valid JSON. Reply with JSON only, no prose."}
+        ]
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return load_scene(scene_text)
+            except json.JSONDecodeError:
+                if attempt == MAX_RETRIES or time.monotonic() >= deadline:
+                    break
+            print("*The ancient scroll seems blurry, trying to decipher it again...*")
+            # JSON mode can't be combined with streaming, but retries aren't streamed
+            scene_text = await self._cached_content(retry_messages, response_format={"type": "json_object"})
+        return {
+            "story": f"""
 🤖 EMERGENCY STORY CONCLUSION PROTOCOL ACTIVATED! 🤖
 
 Suddenly, a wild developer appears!
@@ -544,48 +1090,22 @@ THE END (brought to you by Technical Difficulties™)
 Final Stats:
 Health: {self.player.health}
 Gold: {self.player.gold}
-Inventory: {', '.join(self.player.inventory) if self.player.inventory else 'None'}
-                    """,
-                    "choices": [],
-                    "effects": {}
-                }
-
-def process_scene(scene_text, retries=0):
-    MAX_RETRIES = 3
-    try:
-        scene_data = json.loads(scene_text)
-        return scene_data
-    except json.JSONDecodeError:
-        if retries < MAX_RETRIES:
-            print("*The ancient scroll seems blurry, trying to decipher it again...*")
-            # Retry the LLM call
-            new_response = get_next_scene()  # Make sure to import/define this function
-            return process_scene(new_response, retries + 1)
-        else:
-            print("\n" + "*" * 50)
-            print("EMERGENCY STORY CONCLUSION PROTOCOL ACTIVATED!")
-            print("""
-Suddenly, a wild developer appears!
-'Oh no! The story matrix has become corrupted!' they exclaim.
-'But fear not, for your adventure was automatically backed up to the cloud!'
-
-Your character went on to become a successful cloud storage salesperson, 
-teaching other adventurers about the importance of data backup.
-
-THE END (brought to you by Technical Difficulties™)
-            """)
-            return {
-                "description": "Emergency ending activated",
-                "choices": [],
-                "game_over": True
-            }
+Inventory: {self.player.inventory_text()}
+            """,
+            "choices": [],
+            "effects": {}
+        }
 
 def main():
     try:
         root = tk.Tk()
+        # Show the window before the slower game setup and imports
+        root.title("⚔️ Fantasy Adventure Quest ⚔️")
+        root.update()
         app = AdventureGameGUI(root)
         root.mainloop()
     except Exception as e:
+        from tkinter import messagebox
         messagebox.showerror("Error", f"An error occurred: {e}")
 
 if __name__ == "__main__":